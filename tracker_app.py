@@ -1,7 +1,8 @@
-from datetime import datetime, date
+from datetime import date
+import time
+import numpy as np
 import pandas as pd
 import streamlit as st
-import matplotlib.pyplot as plt
 
 import gspread
 from google.oauth2.service_account import Credentials
@@ -17,21 +18,111 @@ def get_gsheets_client():
     creds = Credentials.from_service_account_info(creds_dict, scopes=scopes)
     return gspread.authorize(creds)
 
+@st.cache_resource
 def open_sheet():
     gc = get_gsheets_client()
     spreadsheet_id = st.secrets["sheets"]["spreadsheet_id"]
     return gc.open_by_key(spreadsheet_id)
 
-def append_row(sheet_name: str, row_values: list):
-    sh = open_sheet()
-    ws = sh.worksheet(sheet_name)
-    ws.append_row(row_values, value_input_option="USER_ENTERED")
+@st.cache_resource
+def get_ws(sheet_name: str):
+    return open_sheet().worksheet(sheet_name)
+
+def append_rows(sheet_name: str, rows: list):
+    ws = get_ws(sheet_name)
+    ws.append_rows(rows, value_input_option="USER_ENTERED")
+
+# column types per sheet, applied once when the sheet is loaded
+SHEET_SCHEMAS = {
+    "weight": {
+        "parse_dates": ["date"],
+        "dtype": {"weight_kg": "float64", "waist_cm": "float64", "sleep_h": "float64"},
+    },
+}
+
+def values_to_df(sheet_name: str, values: list) -> pd.DataFrame:
+    if not values:
+        return pd.DataFrame()
+    header = values[0]  # row1 is the header
+    width = len(header)
+    # the API drops trailing empty cells; pad with "" like get_all_records
+    rows = [(row + [""] * width)[:width] for row in values[1:]]
+    df = pd.DataFrame(rows, columns=header)
+    schema = SHEET_SCHEMAS.get(sheet_name, {})
+    for col in schema.get("parse_dates", []):
+        if col in df:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+    for col, dtype in schema.get("dtype", {}).items():
+        if col in df:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype(dtype)
+    # any other column whose filled cells are all numbers becomes numeric,
+    # as get_all_records did per cell
+    typed = set(schema.get("parse_dates", [])) | set(schema.get("dtype", {}))
+    for col in df.columns:
+        if col in typed:
+            continue
+        filled = df[col] != ""
+        nums = pd.to_numeric(df[col].where(filled), errors="coerce")
+        if filled.any() and nums[filled].notna().all():
+            df[col] = nums
+    return df
 
-def read_df(sheet_name: str) -> pd.DataFrame:
+@st.cache_data(ttl=60)
+def read_all_dfs(sheet_names=("weight", "meals", "workouts")):
+    # one batchGet round-trip instead of one request per sheet
     sh = open_sheet()
-    ws = sh.worksheet(sheet_name)
-    records = ws.get_all_records()  # uses row1 as header
-    return pd.DataFrame(records)
+    resp = sh.values_batch_get(list(sheet_names))
+    return tuple(
+        values_to_df(name, vr.get("values", []))
+        for name, vr in zip(sheet_names, resp["valueRanges"])
+    )
+
+def _now_iso() -> str:
+    # local time, same format as datetime.now().isoformat(timespec="seconds")
+    return time.strftime("%Y-%m-%dT%H:%M:%S")
+
+def rolling_mean(a: np.ndarray, window: int = 7) -> np.ndarray:
+    # same result as Series.rolling(window, min_periods=1).mean(), via prefix sums
+    valid = ~np.isnan(a)
+    csum = np.cumsum(np.where(valid, a, 0.0))
+    ccnt = np.cumsum(valid)
+    wsum = csum.copy()
+    wcnt = ccnt.copy()
+    wsum[window:] -= csum[:-window]
+    wcnt[window:] -= ccnt[:-window]
+    out = np.full(a.shape, np.nan)
+    np.divide(wsum, wcnt, out=out, where=wcnt > 0)
+    return out
+
+def clear_read_cache():
+    read_all_dfs.clear()
+
+
+# ----------------------------
+# Retry queue for failed saves
+# ----------------------------
+def pending_rows() -> dict:
+    if "pending" not in st.session_state:
+        st.session_state["pending"] = {"weight": [], "meals": [], "workouts": []}
+    return st.session_state["pending"]
+
+def pending_count() -> int:
+    return sum(len(rows) for rows in pending_rows().values())
+
+def flush_pending():
+    # a sheet's rows are dropped only after its append succeeds
+    try:
+        for sheet_name, rows in pending_rows().items():
+            if rows:
+                append_rows(sheet_name, rows)
+                rows.clear()
+    finally:
+        clear_read_cache()
+
+def save_row(sheet_name: str, row_values: list):
+    """Write a row now, together with any rows left over from failed saves."""
+    pending_rows()[sheet_name].append(row_values)
+    flush_pending()
 
 
 # ----------------------------
@@ -40,132 +131,143 @@ def read_df(sheet_name: str) -> pd.DataFrame:
 st.set_page_config(page_title="감량 코치 트래커", layout="wide")
 st.title("감량 코치 트래커 (Google Sheets 영구 저장)")
 
+def sync_status():
+    if not pending_count():
+        return
+    if st.button(f"동기화 (저장 안 된 기록 {pending_count()}건)"):
+        try:
+            flush_pending()
+            st.success("동기화 완료! (Google Sheets)")
+        except Exception as e:
+            st.error(f"동기화 실패: {e}")
+
 tab1, tab2, tab3 = st.tabs(["✅ 오늘 기록", "📊 대시보드", "🗂 데이터 보기/백업"])
 
 
 with tab1:
+    sync_status()
+
+    # shared by all three forms below, so it lives outside them
+    d = st.date_input("날짜", value=date.today())
+
     st.subheader("1) 체중/허리/컨디션 기록")
-    colA, colB, colC, colD = st.columns(4)
+    with st.form("weight_form", clear_on_submit=True):
+        colA, colB, colC, colD = st.columns(4)
 
-    with colA:
-        d = st.date_input("날짜", value=date.today())
-        weight = st.number_input("체중(kg)", min_value=0.0, step=0.1, value=0.0)
-    with colB:
-        waist = st.number_input("허리둘레(cm) (없으면 0)", min_value=0.0, step=0.5, value=0.0)
-        sleep_h = st.number_input("수면(시간)", min_value=0.0, step=0.5, value=7.0)
-    with colC:
-        condition = st.slider("컨디션(1~5)", 1, 5, 3)
-        alcohol = st.selectbox("음주", ["없음", "1~2잔", "소주 1병", "소주 1병 이상"])
-    with colD:
-        if st.button("체중/컨디션 저장"):
-            try:
-                append_row(
-                    "weight",
-                    [
-                        datetime.now().isoformat(timespec="seconds"),
-                        d.isoformat(),
-                        float(weight),
-                        float(waist),
-                        float(sleep_h),
-                        int(condition),
-                        alcohol,
-                    ],
-                )
-                st.success("저장 완료! (Google Sheets)")
-            except Exception as e:
-                st.error(f"저장 실패: {e}")
+        with colA:
+            weight = st.number_input("체중(kg)", min_value=0.0, step=0.1, value=0.0)
+        with colB:
+            waist = st.number_input("허리둘레(cm) (없으면 0)", min_value=0.0, step=0.5, value=0.0)
+            sleep_h = st.number_input("수면(시간)", min_value=0.0, step=0.5, value=7.0)
+        with colC:
+            condition = st.slider("컨디션(1~5)", 1, 5, 3)
+            alcohol = st.selectbox("음주", ["없음", "1~2잔", "소주 1병", "소주 1병 이상"])
+        with colD:
+            if st.form_submit_button("체중/컨디션 저장"):
+                try:
+                    save_row(
+                        "weight",
+                        [
+                            _now_iso(),
+                            d.isoformat(),
+                            float(weight),
+                            float(waist),
+                            float(sleep_h),
+                            int(condition),
+                            alcohol,
+                        ],
+                    )
+                    st.success("저장 완료! (Google Sheets)")
+                except Exception as e:
+                    st.error(f"저장 실패 (다음 저장 때 다시 시도): {e}")
 
     st.divider()
     st.subheader("2) 식단 기록 (카톡처럼 한 줄로 붙여넣기 가능)")
-    meal_slot = st.selectbox("식사 구간", ["출근 전", "근무 중", "운동 전", "운동 후", "기타"])
-    items = st.text_area("먹은 것(자유 입력)", placeholder="예) 위트빅스 3조각 + 프로틴 1스쿱, 햄 200g, 계란 3개")
-    meal_notes = st.text_input("메모(선택)", placeholder="예) 저탄수일 / 술자리 / 외식")
-
-    if st.button("식단 저장"):
-        if items.strip() == "":
-            st.error("먹은 것을 입력해줘.")
-        else:
+    with st.form("meal_form", clear_on_submit=True):
+        meal_slot = st.selectbox("식사 구간", ["출근 전", "근무 중", "운동 전", "운동 후", "기타"])
+        items = st.text_area("먹은 것(자유 입력)", placeholder="예) 위트빅스 3조각 + 프로틴 1스쿱, 햄 200g, 계란 3개")
+        meal_notes = st.text_input("메모(선택)", placeholder="예) 저탄수일 / 술자리 / 외식")
+
+        if st.form_submit_button("식단 저장"):
+            items_s = items.strip()
+            notes_s = meal_notes.strip()
+            if not items_s:
+                st.error("먹은 것을 입력해줘.")
+            else:
+                try:
+                    save_row(
+                        "meals",
+                        [
+                            _now_iso(),
+                            d.isoformat(),
+                            meal_slot,
+                            items_s,
+                            notes_s,
+                        ],
+                    )
+                    st.success("식단 저장 완료! (Google Sheets)")
+                except Exception as e:
+                    st.error(f"저장 실패 (다음 저장 때 다시 시도): {e}")
+
+    st.divider()
+    st.subheader("3) 운동 기록")
+    with st.form("workout_form", clear_on_submit=True):
+        wtype = st.selectbox("운동 종류", ["상체", "하체", "전신", "유산소", "휴식"])
+        duration = st.number_input("운동 시간(분)", min_value=0, step=5, value=60)
+        wnotes = st.text_input("운동 메모(선택)", placeholder="예) 스쿼트 170, 데드 220 / 인터벌 10분")
+
+        if st.form_submit_button("운동 저장"):
+            wnotes_s = wnotes.strip()
             try:
-                append_row(
-                    "meals",
+                save_row(
+                    "workouts",
                     [
-                        datetime.now().isoformat(timespec="seconds"),
+                        _now_iso(),
                         d.isoformat(),
-                        meal_slot,
-                        items.strip(),
-                        meal_notes.strip(),
+                        wtype,
+                        int(duration),
+                        wnotes_s,
                     ],
                 )
-                st.success("식단 저장 완료! (Google Sheets)")
+                st.success("운동 저장 완료! (Google Sheets)")
             except Exception as e:
-                st.error(f"저장 실패: {e}")
-
-    st.divider()
-    st.subheader("3) 운동 기록")
-    wtype = st.selectbox("운동 종류", ["상체", "하체", "전신", "유산소", "휴식"])
-    duration = st.number_input("운동 시간(분)", min_value=0, step=5, value=60)
-    wnotes = st.text_input("운동 메모(선택)", placeholder="예) 스쿼트 170, 데드 220 / 인터벌 10분")
-
-    if st.button("운동 저장"):
-        try:
-            append_row(
-                "workouts",
-                [
-                    datetime.now().isoformat(timespec="seconds"),
-                    d.isoformat(),
-                    wtype,
-                    int(duration),
-                    wnotes.strip(),
-                ],
-            )
-            st.success("운동 저장 완료! (Google Sheets)")
-        except Exception as e:
-            st.error(f"저장 실패: {e}")
+                st.error(f"저장 실패 (다음 저장 때 다시 시도): {e}")
 
 
 with tab2:
     st.subheader("📊 대시보드")
 
+    if pending_count():
+        st.caption(f"저장 안 된 기록 {pending_count()}건은 동기화 후 반영돼.")
+
     try:
-        wdf = read_df("weight")
-        mdf = read_df("meals")
-        odf = read_df("workouts")
+        wdf, mdf, odf = read_all_dfs()
     except Exception as e:
         st.error(f"시트 읽기 실패: {e}")
         st.stop()
 
     if not wdf.empty:
-        # type conversion
-        wdf["date"] = pd.to_datetime(wdf["date"], errors="coerce")
-        wdf["weight_kg"] = pd.to_numeric(wdf.get("weight_kg"), errors="coerce")
-        wdf["waist_cm"] = pd.to_numeric(wdf.get("waist_cm"), errors="coerce")
+        # types are already converted in values_to_df
         wdf = wdf.sort_values("date")
 
-        wdf["w7"] = wdf["weight_kg"].rolling(window=7, min_periods=1).mean()
+        wdf["w7"] = rolling_mean(wdf["weight_kg"].to_numpy(np.float64), 7)
 
         col1, col2, col3 = st.columns(3)
         latest = wdf.dropna(subset=["weight_kg"]).tail(1)
         if not latest.empty:
-            col1.metric("최근 체중(kg)", f"{float(latest['weight_kg'].iloc[0]):.1f}")
-            col2.metric("최근 7일 평균(kg)", f"{float(latest['w7'].iloc[0]):.1f}")
-        if wdf["waist_cm"].dropna().shape[0] > 0:
-            col3.metric("최근 허리(cm)", f"{float(wdf['waist_cm'].dropna().iloc[-1]):.1f}")
-
-        fig = plt.figure()
-        plt.plot(wdf["date"], wdf["weight_kg"], marker="o")
-        plt.plot(wdf["date"], wdf["w7"])
-        plt.title("체중 추세 (7일 평균 포함)")
-        plt.xlabel("date")
-        plt.ylabel("kg")
-        st.pyplot(fig)
-
-        if wdf["waist_cm"].dropna().shape[0] > 0:
-            fig2 = plt.figure()
-            plt.plot(wdf["date"], wdf["waist_cm"], marker="o")
-            plt.title("허리둘레 추세")
-            plt.xlabel("date")
-            plt.ylabel("cm")
-            st.pyplot(fig2)
+            col1.metric("최근 체중(kg)", f"{latest['weight_kg'].iat[0]:.1f}")
+            col2.metric("최근 7일 평균(kg)", f"{latest['w7'].iat[0]:.1f}")
+        by_date = wdf.set_index("date")
+        waist_s = by_date["waist_cm"].dropna()
+        if waist_s.size:
+            col3.metric("최근 허리(cm)", f"{waist_s.iat[-1]:.1f}")
+
+        st.caption("체중 추세 (7일 평균 포함, kg)")
+        st.line_chart(by_date[["weight_kg", "w7"]])
+
+        if waist_s.size:
+            st.caption("허리둘레 추세 (cm)")
+            st.line_chart(waist_s)
     else:
         st.info("아직 체중/컨디션 데이터가 없어. '오늘 기록' 탭에서 먼저 저장해줘.")
 